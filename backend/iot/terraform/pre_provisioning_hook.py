@@ -5,13 +5,22 @@ Cleans up existing thing and certificates if device is being re-provisioned.
 
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-iot = boto3.client('iot')
+MAX_WORKERS = 16
+
+iot = boto3.client('iot', config=Config(
+    retries={'mode': 'adaptive', 'max_attempts': 3},
+    tcp_keepalive=True,
+    max_pool_connections=MAX_WORKERS
+))
 
 
 def handler(event, context):
@@ -48,37 +57,19 @@ def cleanup_thing(thing_name):
     """Remove thing and its attached certificates."""
     # Get attached principals (certificates)
     try:
-        principals = iot.list_thing_principals(thingName=thing_name)['principals']
+        paginator = iot.get_paginator('list_thing_principals')
+        principals = [
+            principal
+            for page in paginator.paginate(thingName=thing_name)
+            for principal in page['principals']
+        ]
     except ClientError as e:
         logger.warning(f"Could not list principals for {thing_name}: {e}")
         principals = []
 
     # Detach and delete each certificate
-    for principal in principals:
-        cert_id = principal.split('/')[-1]
-        logger.info(f"Cleaning up certificate {cert_id}")
-
-        try:
-            # Detach from thing
-            iot.detach_thing_principal(thingName=thing_name, principal=principal)
-        except ClientError as e:
-            logger.warning(f"Could not detach principal: {e}")
-
-        try:
-            # Detach policies from certificate
-            policies = iot.list_attached_policies(target=principal)['policies']
-            for policy in policies:
-                iot.detach_policy(policyName=policy['policyName'], target=principal)
-        except ClientError as e:
-            logger.warning(f"Could not detach policies: {e}")
-
-        try:
-            # Deactivate and delete certificate
-            iot.update_certificate(certificateId=cert_id, newStatus='INACTIVE')
-            iot.delete_certificate(certificateId=cert_id)
-            logger.info(f"Deleted certificate {cert_id}")
-        except ClientError as e:
-            logger.warning(f"Could not delete certificate: {e}")
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        list(executor.map(lambda principal: cleanup_certificate(thing_name, principal), principals))
 
     # Delete the thing
     try:
@@ -87,3 +78,31 @@ def cleanup_thing(thing_name):
     except ClientError as e:
         logger.warning(f"Could not delete thing: {e}")
 
+
+def cleanup_certificate(thing_name, principal):
+    """Detach and delete a certificate."""
+    cert_id = principal.split('/')[-1]
+    logger.info(f"Cleaning up certificate {cert_id}")
+
+    try:
+        # Detach from thing
+        iot.detach_thing_principal(thingName=thing_name, principal=principal)
+    except ClientError as e:
+        logger.warning(f"Could not detach principal: {e}")
+
+    try:
+        # Detach policies from certificate
+        paginator = iot.get_paginator('list_attached_policies')
+        for page in paginator.paginate(target=principal):
+            for policy in page['policies']:
+                iot.detach_policy(policyName=policy['policyName'], target=principal)
+    except ClientError as e:
+        logger.warning(f"Could not detach policies: {e}")
+
+    try:
+        # Deactivate and delete certificate
+        iot.update_certificate(certificateId=cert_id, newStatus='INACTIVE')
+        iot.delete_certificate(certificateId=cert_id)
+        logger.info(f"Deleted certificate {cert_id}")
+    except ClientError as e:
+        logger.warning(f"Could not delete certificate: {e}")
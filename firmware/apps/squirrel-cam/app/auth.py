@@ -11,16 +11,26 @@ import asyncio
 from pathlib import Path
 
 import aiohttp
+import uvloop
 from blinkpy.blinkpy import Blink
 from blinkpy.auth import Auth
 
 CREDENTIALS_PATH = Path("/data/credentials.json")
 
 
+def save_credentials(login_attributes: dict):
+    """Save credentials with token."""
+    CREDENTIALS_PATH.parent.mkdir(parents=True, exist_ok=True)
+    with open(CREDENTIALS_PATH, "w") as f:
+        json.dump(login_attributes, f, separators=(",", ":"))
+
+
 async def authenticate(email: str, password: str):
     print(f"Authenticating {email}...")
 
-    async with aiohttp.ClientSession() as session:
+    connector = aiohttp.TCPConnector(limit=8, limit_per_host=4, ttl_dns_cache=300, keepalive_timeout=60)
+    timeout = aiohttp.ClientTimeout(total=60, connect=10)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
         blink = Blink(session=session)
         auth = Auth({"username": email, "password": password}, no_prompt=True, session=session)
         blink.auth = auth
@@ -36,10 +46,7 @@ async def authenticate(email: str, password: str):
             print("ERROR: No cameras found")
             return False
 
-        # Save credentials with token
-        CREDENTIALS_PATH.parent.mkdir(parents=True, exist_ok=True)
-        with open(CREDENTIALS_PATH, "w") as f:
-            json.dump(blink.auth.login_attributes, f, indent=2)
+        await asyncio.to_thread(save_credentials, blink.auth.login_attributes)
 
         print(f"Success! Saved to {CREDENTIALS_PATH}")
         print(f"Cameras: {list(blink.cameras.keys())}")
@@ -52,7 +59,7 @@ def main():
         sys.exit(1)
 
     try:
-        success = asyncio.run(authenticate(sys.argv[1], sys.argv[2]))
+        success = uvloop.run(authenticate(sys.argv[1], sys.argv[2]))
         sys.exit(0 if success else 1)
     except KeyboardInterrupt:
         print("\nCancelled")
@@ -6,18 +6,26 @@ Listens for detection events from inference container and handles alerts.
 """
 
 import os
-import json
 import asyncio
+import logging
 import socket
+import sys
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import orjson
+import uvloop
 
 SOCKET_PATH = os.environ.get("SOCKET_PATH", "/tmp/detections.sock")
 DETECTION_THRESHOLD = float(os.environ.get("DETECTION_THRESHOLD", "0.5"))
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
 
-TARGET_CLASSES = {"bird", "cat", "dog", "squirrel", "chipmunk", "raccoon"}
+TARGET_CLASSES = frozenset({"bird", "cat", "dog", "squirrel", "chipmunk", "raccoon"})
+MAX_TRACKED_DETECTIONS = 1000
 
 
-def log(msg):
-    print(f"[squirrel-cam] {msg}", flush=True)
+logger = logging.getLogger("squirrel-cam")
 
 
 class DetectionListener:
@@ -26,7 +34,9 @@ class DetectionListener:
     def __init__(self):
         self.threshold = DETECTION_THRESHOLD
         self.sock = None
-        self.recent_detections = {}
+        self.buf = bytearray(65536)
+        self.view = memoryview(self.buf)
+        self.recent_detections = OrderedDict()
 
     def setup_socket(self):
         client_path = SOCKET_PATH + ".client"
@@ -36,58 +46,65 @@ class DetectionListener:
         self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
         self.sock.bind(client_path)
         self.sock.setblocking(False)
-        log(f"Listening on {client_path}")
+        logger.info("Listening on %s", client_path)
 
     async def run(self):
         self.setup_socket()
-        log("Waiting for detection events...")
-
-        loop = asyncio.get_event_loop()
+        logger.info("Waiting for detection events...")
+
+        loop = asyncio.get_running_loop()
+        fd = self.sock.fileno()
+        loop.add_reader(fd, self._on_datagram)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            loop.remove_reader(fd)
+
+    def _on_datagram(self):
+        try:
+            size = self.sock.recv_into(self.buf)
+            detections = orjson.loads(self.view[:size])
+        except (BlockingIOError, orjson.JSONDecodeError):
+            return
+        except Exception as e:
+            logger.error("Error receiving detection: %s", e)
+            return
 
-        while True:
+        for detection in detections:
             try:
-                data = await loop.sock_recv(self.sock, 4096)
-                detection = json.loads(data.decode())
                 self.handle_detection(detection)
-            except BlockingIOError:
-                await asyncio.sleep(0.01)
-            except json.JSONDecodeError:
-                continue
             except Exception as e:
-                log(f"Error receiving detection: {e}")
-                await asyncio.sleep(1)
+                logger.error("Error handling detection: %s", e)
 
     def handle_detection(self, detection: dict):
-        class_name = detection.get("class_name", "")
-        confidence = detection.get("confidence", 0)
         track_id = detection.get("track_id", 0)
 
-        if confidence < self.threshold:
+        # Dedupe by track_id - only alert once per tracked object
+        if track_id in self.recent_detections:
+            self.recent_detections.move_to_end(track_id)
             return
 
-        if class_name not in TARGET_CLASSES:
+        if detection.get("class_name", "") not in TARGET_CLASSES:
             return
 
-        # Dedupe by track_id - only alert once per tracked object
-        if track_id in self.recent_detections:
+        if detection.get("confidence", 0) < self.threshold:
             return
 
         self.recent_detections[track_id] = detection
         self.on_target_detected(detection)
 
-        # Cleanup old tracks after 1000 entries
-        if len(self.recent_detections) > 1000:
-            self.recent_detections.clear()
+        if len(self.recent_detections) > MAX_TRACKED_DETECTIONS:
+            self.recent_detections.popitem(last=False)
 
     def on_target_detected(self, detection: dict):
         class_name = detection["class_name"]
         confidence = detection["confidence"]
-        timestamp = detection.get("timestamp", "")
 
         if class_name == "squirrel":
-            log(f"🐿️  SQUIRREL detected! conf={confidence:.2f} at {timestamp}")
+            timestamp = datetime.fromtimestamp(detection.get("timestamp_ns", time.time_ns()) / 1e9).isoformat()
+            logger.info("🐿️  SQUIRREL detected! conf=%.2f at %s", confidence, timestamp)
         else:
-            log(f"Detected {class_name} (conf={confidence:.2f})")
+            logger.info("Detected %s (conf=%.2f)", class_name, confidence)
 
     def cleanup(self):
         if self.sock:
@@ -98,8 +115,9 @@ class DetectionListener:
 
 
 async def main():
-    log("Starting detection listener...")
-    log(f"Threshold: {DETECTION_THRESHOLD}")
+    logging.basicConfig(level=LOG_LEVEL, format="[squirrel-cam] %(message)s", stream=sys.stdout)
+    logger.info("Starting detection listener...")
+    logger.info("Threshold: %s", DETECTION_THRESHOLD)
 
     listener = DetectionListener()
     try:
@@ -109,4 +127,4 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    uvloop.run(main())
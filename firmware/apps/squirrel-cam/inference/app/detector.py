@@ -6,15 +6,15 @@ Publishes detection events and outputs annotated RTSP stream.
 
 import os
 import sys
-import json
+import logging
 import socket
 import time
 import threading
-from datetime import datetime
 from pathlib import Path
 
 import cv2
 import numpy as np
+import orjson
 
 # Configuration via environment
 SOURCE_URI = os.environ.get("SOURCE_URI", "rtsp://go2rtc:8554/test")
@@ -22,6 +22,20 @@ RTSP_PORT = int(os.environ.get("RTSP_PORT", "8555"))
 SOCKET_PATH = os.environ.get("SOCKET_PATH", "/tmp/detections.sock")
 DETECTION_THRESHOLD = float(os.environ.get("DETECTION_THRESHOLD", "0.5"))
 MODEL_PATH = os.environ.get("MODEL_PATH", "/models/yolov8n.engine")
+BATCH_SIZE = int(os.environ.get("BATCH_SIZE", "1"))
+MODEL_PRECISION = os.environ.get("MODEL_PRECISION", "fp16")
+CALIBRATION_DATA = os.environ.get("CALIBRATION_DATA", "coco8.yaml")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+ENABLE_PREVIEW = os.environ.get("ENABLE_PREVIEW", "1") == "1"
+ENGINE_PATH = Path(MODEL_PATH).with_name(f"{Path(MODEL_PATH).stem}-b{BATCH_SIZE}-{MODEL_PRECISION}.engine")
+
+CAPTURE_PIPELINE = os.environ.get(
+    "CAPTURE_PIPELINE",
+    f'rtspsrc location="{SOURCE_URI}" latency=0 ! rtph264depay ! h264parse ! '
+    f"nvv4l2decoder ! nvvidconv ! video/x-raw,format=BGRx ! "
+    f"videoconvert ! video/x-raw,format=BGR ! "
+    f"appsink drop=true max-buffers=1 sync=false"
+)
 
 # Target classes (COCO class IDs)
 TARGET_CLASSES = {
@@ -32,8 +46,7 @@ TARGET_CLASSES = {
 }
 
 
-def log(msg):
-    print(f"[detector] {msg}", flush=True)
+logger = logging.getLogger("detector")
 
 
 class DetectionPublisher:
@@ -47,21 +60,25 @@ class DetectionPublisher:
     def connect(self):
         if self.sock:
             return True
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.setblocking(False)
         try:
-            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
-            self.sock.setblocking(False)
-            return True
-        except Exception:
+            sock.connect(self.client_path)
+        except OSError:
+            sock.close()
             return False
+        self.sock = sock
+        return True
 
-    def publish(self, detection: dict):
-        if not self.sock:
-            self.connect()
+    def publish_batch(self, detections: list):
+        if not self.connect():
+            return
         try:
-            msg = json.dumps(detection).encode()
-            self.sock.sendto(msg, self.client_path)
-        except Exception:
+            self.sock.send(orjson.dumps(detections))
+        except BlockingIOError:
             pass
+        except (ConnectionRefusedError, FileNotFoundError):
+            self.close()
 
     def close(self):
         if self.sock:
@@ -75,148 +92,187 @@ class RTSPServer:
     def __init__(self, port: int):
         self.port = port
         self.frame = None
-        self.lock = threading.Lock()
+        self.detections = None
+        self.new_frame = False
+        self.cond = threading.Condition()
         self.running = False
 
     def start(self):
         self.running = True
         self.thread = threading.Thread(target=self._serve, daemon=True)
         self.thread.start()
-        log(f"RTSP output on port {self.port}")
+        logger.info("RTSP output on port %s", self.port)
 
-    def update_frame(self, frame):
-        with self.lock:
-            self.frame = frame.copy()
+    def update_frame(self, frame, detections):
+        with self.cond:
+            self.frame = frame
+            self.detections = detections
+            self.new_frame = True
+            self.cond.notify()
 
     def _serve(self):
         # GStreamer pipeline for RTSP output
         gst_out = (
-            f"appsrc ! videoconvert ! x264enc tune=zerolatency bitrate=2000 ! "
+            f"appsrc is-live=true do-timestamp=true format=time ! videoconvert ! x264enc tune=zerolatency bitrate=2000 ! "
             f"rtph264pay ! udpsink host=127.0.0.1 port=5400"
         )
         out = None
 
-        while self.running:
-            with self.lock:
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.new_frame or not self.running)
+                if not self.running:
+                    break
                 frame = self.frame
+                detections = self.detections
+                self.new_frame = False
 
-            if frame is not None:
-                if out is None:
-                    h, w = frame.shape[:2]
-                    out = cv2.VideoWriter(gst_out, cv2.CAP_GSTREAMER, 0, 30, (w, h))
-                out.write(frame)
+            if detections:
+                draw_detections(frame, detections)
 
-            time.sleep(0.03)  # ~30 FPS
+            if out is None:
+                h, w = frame.shape[:2]
+                out = cv2.VideoWriter(gst_out, cv2.CAP_GSTREAMER, 0, 30, (w, h))
+            out.write(frame)
 
         if out:
             out.release()
 
     def stop(self):
-        self.running = False
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+
+def draw_detections(frame, detections):
+    """Draw detections on frame."""
+    for detection in detections:
+        bbox = detection["bbox"]
+        x1, y1 = bbox["left"], bbox["top"]
+        x2, y2 = x1 + bbox["width"], y1 + bbox["height"]
+        cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        label = f"{detection['class_name']} {detection['confidence']:.2f}"
+        cv2.putText(frame, label, (x1, y1 - 10),
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
 
 
 def download_model():
     """Download and convert model to TensorRT if needed."""
-    model_path = Path(MODEL_PATH)
-
-    if model_path.exists():
-        log(f"Model found: {MODEL_PATH}")
-        return True
+    for model_path in (Path(MODEL_PATH), ENGINE_PATH):
+        if model_path.exists():
+            logger.info("Model found: %s", model_path)
+            return model_path
 
-    log("Converting YOLOv8n to TensorRT engine...")
+    logger.info("Converting YOLOv8n to %s TensorRT engine...", MODEL_PRECISION)
     try:
         from ultralytics import YOLO
 
         # Download and export to TensorRT
         model = YOLO("yolov8n.pt")
-        model.export(format="engine", imgsz=640, half=True)
+        if MODEL_PRECISION == "int8":
+            model.export(format="engine", imgsz=640, int8=True, data=CALIBRATION_DATA, batch=BATCH_SIZE)
+        else:
+            model.export(format="engine", imgsz=640, half=True, batch=BATCH_SIZE)
 
         # Move to models directory
         import shutil
         engine_file = Path("yolov8n.engine")
         if engine_file.exists():
-            model_path.parent.mkdir(parents=True, exist_ok=True)
-            shutil.move(str(engine_file), str(model_path))
-            log(f"Model saved to {MODEL_PATH}")
-            return True
+            ENGINE_PATH.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(engine_file), str(ENGINE_PATH))
+            logger.info("Model saved to %s", ENGINE_PATH)
+            return ENGINE_PATH
         else:
-            log("Engine file not created")
-            return False
+            logger.error("Engine file not created")
+            return None
 
     except Exception as e:
-        log(f"Model conversion failed: {e}")
-        return False
+        logger.error("Model conversion failed: %s", e)
+        return None
 
 
 def main():
-    log("Starting TensorRT detector...")
-    log(f"Source: {SOURCE_URI}")
-    log(f"Model: {MODEL_PATH}")
-    log(f"Threshold: {DETECTION_THRESHOLD}")
-
-    if not download_model():
-        log("Failed to prepare model, exiting")
+    logging.basicConfig(level=LOG_LEVEL, format="[detector] %(message)s", stream=sys.stdout)
+    logger.info("Starting TensorRT detector...")
+    logger.info("Source: %s", SOURCE_URI)
+    logger.info("Model: %s", MODEL_PATH)
+    logger.info("Threshold: %s", DETECTION_THRESHOLD)
+    logger.info("Batch size: %s", BATCH_SIZE)
+
+    model_path = download_model()
+    if model_path is None:
+        logger.error("Failed to prepare model, exiting")
         sys.exit(1)
 
     # Load model
     from ultralytics import YOLO
-    log("Loading TensorRT model...")
-    model = YOLO(MODEL_PATH)
-    log("Model loaded")
+    logger.info("Loading TensorRT model...")
+    model = YOLO(str(model_path))
+    class_names = model.names
+    logger.info("Model loaded")
 
     # Setup
     publisher = DetectionPublisher(SOCKET_PATH)
-    rtsp_server = RTSPServer(RTSP_PORT)
-    rtsp_server.start()
+    rtsp_server = None
+    if ENABLE_PREVIEW:
+        rtsp_server = RTSPServer(RTSP_PORT)
+        rtsp_server.start()
 
     # Open RTSP stream
-    log(f"Connecting to {SOURCE_URI}...")
-    cap = cv2.VideoCapture(SOURCE_URI)
+    logger.info("Connecting to %s...", SOURCE_URI)
+    cap = cv2.VideoCapture(CAPTURE_PIPELINE, cv2.CAP_GSTREAMER)
 
     if not cap.isOpened():
-        log("Failed to open RTSP stream, retrying...")
+        logger.warning("Failed to open RTSP stream, retrying...")
         time.sleep(5)
-        cap = cv2.VideoCapture(SOURCE_URI)
+        cap = cv2.VideoCapture(CAPTURE_PIPELINE, cv2.CAP_GSTREAMER)
         if not cap.isOpened():
-            log("Cannot open RTSP stream")
+            logger.error("Cannot open RTSP stream")
             sys.exit(1)
 
-    log("Stream connected, starting inference...")
+    logger.info("Stream connected, starting inference...")
 
     frame_count = 0
     detection_count = 0
     fps_time = time.time()
+    frames = []
+    timestamps = []
 
     try:
         while True:
             ret, frame = cap.read()
             if not ret:
-                log("Stream ended or error, reconnecting...")
+                logger.warning("Stream ended or error, reconnecting...")
                 time.sleep(2)
                 cap.release()
-                cap = cv2.VideoCapture(SOURCE_URI)
+                cap = cv2.VideoCapture(CAPTURE_PIPELINE, cv2.CAP_GSTREAMER)
+                frames.clear()
+                timestamps.clear()
                 continue
 
-            frame_count += 1
+            frames.append(frame)
+            timestamps.append(time.time_ns())
+            if len(frames) < BATCH_SIZE:
+                continue
 
             # Run inference
-            results = model(frame, conf=DETECTION_THRESHOLD, verbose=False)
+            results = model(frames, conf=DETECTION_THRESHOLD, verbose=False)
 
-            # Process detections
-            for r in results:
-                boxes = r.boxes
-                for box in boxes:
-                    cls_id = int(box.cls[0])
-                    conf = float(box.conf[0])
-
-                    # Get class name
-                    cls_name = model.names.get(cls_id, f"class_{cls_id}")
+            for frame, timestamp_ns, r in zip(frames, timestamps, results):
+                frame_count += 1
 
-                    # Check if it's a target class or just log all
-                    x1, y1, x2, y2 = map(int, box.xyxy[0])
+                # Process detections
+                detections = []
+                boxes = r.boxes
+                for cls_id, conf, (x1, y1, x2, y2) in zip(
+                    boxes.cls.int().tolist(),
+                    boxes.conf.tolist(),
+                    boxes.xyxy.int().tolist(),
+                ):
+                    cls_name = class_names[cls_id]
 
                     detection = {
-                        "timestamp": datetime.now().isoformat(),
+                        "timestamp_ns": timestamp_ns,
                         "frame": frame_count,
                         "class_id": cls_id,
                         "class_name": cls_name,
@@ -229,32 +285,34 @@ def main():
                         }
                     }
 
-                    detection_count += 1
-                    publisher.publish(detection)
+                    detections.append(detection)
+
+                if detections:
+                    detection_count += len(detections)
+                    publisher.publish_batch(detections)
 
-                    # Draw on frame
-                    cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                    label = f"{cls_name} {conf:.2f}"
-                    cv2.putText(frame, label, (x1, y1 - 10),
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+                # Update RTSP output
+                if rtsp_server:
+                    rtsp_server.update_frame(frame, detections)
 
-            # Update RTSP output
-            rtsp_server.update_frame(frame)
+                # Log FPS every 100 frames
+                if frame_count % 100 == 0:
+                    elapsed = time.time() - fps_time
+                    fps = 100 / elapsed
+                    logger.info("Frame %s, %s detections, %.1f FPS", frame_count, detection_count, fps)
+                    fps_time = time.time()
 
-            # Log FPS every 100 frames
-            if frame_count % 100 == 0:
-                elapsed = time.time() - fps_time
-                fps = 100 / elapsed
-                log(f"Frame {frame_count}, {detection_count} detections, {fps:.1f} FPS")
-                fps_time = time.time()
+            frames.clear()
+            timestamps.clear()
 
     except KeyboardInterrupt:
-        log("Interrupted")
+        logger.info("Interrupted")
     finally:
         cap.release()
-        rtsp_server.stop()
+        if rtsp_server:
+            rtsp_server.stop()
         publisher.close()
-        log(f"Processed {frame_count} frames, {detection_count} detections")
+        logger.info("Processed %s frames, %s detections", frame_count, detection_count)
 
 
 if __name__ == "__main__":
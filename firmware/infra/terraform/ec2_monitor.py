@@ -1,11 +1,20 @@
 import os
+import time
 import boto3
+from botocore.config import Config
 from datetime import datetime, timezone
-from typing import Optional, Tuple
+from typing import Optional
 
 region = os.environ.get('AWS_REGION', 'us-east-2')
-ec2 = boto3.client('ec2', region_name=region)
-sns = boto3.client('sns', region_name=region)
+session = boto3.Session(region_name=region)
+config = Config(
+    retries={'mode': 'adaptive', 'max_attempts': 3},
+    tcp_keepalive=True,
+    connect_timeout=2,
+    read_timeout=5
+)
+ec2 = session.client('ec2', config=config)
+sns = session.client('sns', config=config)
 
 INSTANCE_NAME = os.environ['INSTANCE_NAME']
 ALERT_THRESHOLD_HOURS = int(os.environ['ALERT_THRESHOLD_HOURS'])
@@ -16,17 +25,17 @@ DATA_VOLUME_NAME = 'yocto-builder-data'
 SNAPSHOT_NAME = 'yocto-builder-data-snapshot'
 
 
-def get_instance(state_filter: list[str] = None) -> Optional[dict]:
-    """Get instance by name tag."""
-    filters = [{'Name': 'tag:Name', 'Values': [INSTANCE_NAME]}]
-    if state_filter:
-        filters.append({'Name': 'instance-state-name', 'Values': state_filter})
-
-    response = ec2.describe_instances(Filters=filters)
-    reservations = response.get('Reservations', [])
-    if not reservations or not reservations[0].get('Instances'):
-        return None
-    return reservations[0]['Instances'][0]
+def get_instances(states: list[str]) -> dict[str, dict]:
+    """Get instances by name tag, keyed by state."""
+    response = ec2.describe_instances(Filters=[
+        {'Name': 'tag:Name', 'Values': [INSTANCE_NAME]},
+        {'Name': 'instance-state-name', 'Values': states}
+    ])
+    instances = {}
+    for reservation in response.get('Reservations', []):
+        for instance in reservation.get('Instances', []):
+            instances.setdefault(instance['State']['Name'], instance)
+    return instances
 
 
 def get_instance_uptime_hours(instance: dict) -> int:
@@ -43,11 +52,10 @@ def get_stopped_duration_hours(instance: dict) -> Optional[int]:
         return None
     try:
         # Format: "User initiated (2024-01-15 10:30:45 GMT)"
-        time_str = state_reason.split('(')[1].split(')')[0].replace(' GMT', '')
-        stopped_time = datetime.strptime(time_str, '%Y-%m-%d %H:%M:%S')
-        stopped_time = stopped_time.replace(tzinfo=timezone.utc)
+        time_str = state_reason[state_reason.index('(') + 1:state_reason.index(')')]
+        stopped_time = datetime.strptime(time_str, '%Y-%m-%d %H:%M:%S GMT').replace(tzinfo=timezone.utc)
         return int((datetime.now(timezone.utc) - stopped_time).total_seconds() / 3600)
-    except (IndexError, ValueError):
+    except ValueError:
         return None
 
 
@@ -63,24 +71,53 @@ def get_data_volume() -> Optional[str]:
     return volumes[0]['VolumeId'] if volumes else None
 
 
-def archive_data_volume(volume_id: str) -> Tuple[bool, str]:
-    """Snapshot and delete the data volume."""
+def start_archive(volume_id: str) -> str:
+    """Snapshot the data volume."""
     try:
-        # Create snapshot
+        pending = ec2.describe_snapshots(
+            OwnerIds=['self'],
+            Filters=[
+                {'Name': 'volume-id', 'Values': [volume_id]},
+                {'Name': 'tag:Name', 'Values': [SNAPSHOT_NAME]},
+                {'Name': 'status', 'Values': ['pending']}
+            ]
+        )['Snapshots']
+        if pending:
+            return f'Archive of {volume_id} in progress ({pending[0]["SnapshotId"]})'
+
         snapshot = ec2.create_snapshot(
             VolumeId=volume_id,
-            Description=f'Auto-archive {datetime.now(timezone.utc).strftime("%Y-%m-%d")}',
+            Description=f'Auto-archive {time.strftime("%Y-%m-%d", time.gmtime())}',
             TagSpecifications=[{
                 'ResourceType': 'snapshot',
                 'Tags': [{'Key': 'Name', 'Value': SNAPSHOT_NAME}]
             }]
         )
-        snap_id = snapshot['SnapshotId']
+        return f'Archiving volume {volume_id} to snapshot {snapshot["SnapshotId"]}'
+    except Exception as e:
+        return f'Archive failed: {str(e)}'
+
+
+def complete_archive(event) -> dict:
+    """Delete the data volume after its snapshot completes."""
+    detail = event['detail']
+    volume_id = detail['source'].rsplit('/', 1)[-1]
+    snap_id = detail['snapshot_id'].rsplit('/', 1)[-1]
+
+    if volume_id != get_data_volume():
+        return {'statusCode': 200, 'body': f'Ignoring snapshot {snap_id} of {volume_id}'}
 
-        # Wait for snapshot (with timeout)
-        waiter = ec2.get_waiter('snapshot_completed')
-        waiter.wait(SnapshotIds=[snap_id], WaiterConfig={'Delay': 30, 'MaxAttempts': 60})
+    snapshot = ec2.describe_snapshots(SnapshotIds=[snap_id])['Snapshots'][0]
+    tags = {tag['Key']: tag['Value'] for tag in snapshot.get('Tags', [])}
+    if tags.get('Name') != SNAPSHOT_NAME:
+        return {'statusCode': 200, 'body': f'Ignoring untagged snapshot {snap_id} of {volume_id}'}
 
+    stopped = get_instances(['stopped']).get('stopped')
+    stopped_hours = get_stopped_duration_hours(stopped) if stopped else None
+    if not stopped_hours or stopped_hours < ARCHIVE_AFTER_HOURS:
+        return {'statusCode': 200, 'body': f'Instance not idle, keeping volume {volume_id}'}
+
+    try:
         # Detach if attached
         vol_info = ec2.describe_volumes(VolumeIds=[volume_id])['Volumes'][0]
         if vol_info['Attachments']:
@@ -89,18 +126,15 @@ def archive_data_volume(volume_id: str) -> Tuple[bool, str]:
 
         # Delete volume
         ec2.delete_volume(VolumeId=volume_id)
-
-        return True, f'Archived volume {volume_id} to snapshot {snap_id}'
     except Exception as e:
-        return False, f'Archive failed: {str(e)}'
+        return {'statusCode': 500, 'body': f'Archive failed: {str(e)}'}
 
-
-def should_alert(uptime_hours: int) -> bool:
-    """Determine if we should send an alert."""
-    if uptime_hours < ALERT_THRESHOLD_HOURS:
-        return False
-    hours_over = uptime_hours - ALERT_THRESHOLD_HOURS
-    return hours_over % ALERT_INTERVAL_HOURS == 0
+    send_alert(
+        "Data Volume Auto-Archived",
+        f"Instance stopped for over {ARCHIVE_AFTER_HOURS}h. Data volume archived to snapshot "
+        f"{snap_id} to save costs. Will auto-restore on next start."
+    )
+    return {'statusCode': 200, 'body': f'Archived volume {volume_id} to snapshot {snap_id}'}
 
 
 def send_alert(subject: str, message: str):
@@ -110,13 +144,18 @@ def send_alert(subject: str, message: str):
 
 def lambda_handler(event, context):
     """Check for running alerts and auto-archive idle data volumes."""
+    if event.get('detail-type') == 'EBS Snapshot Notification':
+        return complete_archive(event)
+
     results = []
+    instances = get_instances(['running', 'stopped'])
 
     # Check running instance for uptime alerts
-    running = get_instance(['running'])
+    running = instances.get('running')
     if running:
         uptime = get_instance_uptime_hours(running)
-        if should_alert(uptime):
+        hours_over = uptime - ALERT_THRESHOLD_HOURS
+        if hours_over >= 0 and hours_over % ALERT_INTERVAL_HOURS == 0:
             send_alert(
                 f"EC2 Instance Running Alert",
                 f"EC2 instance {running['InstanceId']} ({INSTANCE_NAME}) has been running for {uptime} hours."
@@ -126,20 +165,13 @@ def lambda_handler(event, context):
             results.append(f'Running for {uptime}h, no alert needed')
 
     # Check stopped instance for auto-archive
-    stopped = get_instance(['stopped'])
+    stopped = instances.get('stopped')
     if stopped:
         stopped_hours = get_stopped_duration_hours(stopped)
         volume_id = get_data_volume()
 
         if stopped_hours and stopped_hours >= ARCHIVE_AFTER_HOURS and volume_id:
-            success, msg = archive_data_volume(volume_id)
-            results.append(msg)
-            if success:
-                send_alert(
-                    "Data Volume Auto-Archived",
-                    f"Instance stopped for {stopped_hours}h. Data volume archived to save costs. "
-                    f"Will auto-restore on next start."
-                )
+            results.append(start_archive(volume_id))
         elif volume_id:
             results.append(f'Stopped {stopped_hours}h, archive after {ARCHIVE_AFTER_HOURS}h')
         else:
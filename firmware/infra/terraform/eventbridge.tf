@@ -18,3 +18,30 @@ resource "aws_lambda_permission" "eventbridge" {
   source_arn    = aws_cloudwatch_event_rule.hourly_check.arn
 }
 
+
+resource "aws_cloudwatch_event_rule" "snapshot_completed" {
+  name        = "yocto-data-snapshot-completed"
+  description = "Finish archiving the data volume once its snapshot completes"
+  event_pattern = jsonencode({
+    source        = ["aws.ec2"]
+    "detail-type" = ["EBS Snapshot Notification"]
+    detail = {
+      event  = ["createSnapshot"]
+      result = ["succeeded"]
+    }
+  })
+}
+
+resource "aws_cloudwatch_event_target" "snapshot_completed" {
+  rule      = aws_cloudwatch_event_rule.snapshot_completed.name
+  target_id = "CompleteArchive"
+  arn       = aws_lambda_function.instance_alert.arn
+}
+
+resource "aws_lambda_permission" "snapshot_completed" {
+  statement_id  = "AllowExecutionFromSnapshotCompleted"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.instance_alert.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.snapshot_completed.arn
+}
@@ -7,19 +7,26 @@ Uses claim certificate with MQTT for zero-touch provisioning.
 import json
 import os
 import ssl
-import subprocess
 import sys
 import threading
 import time
 from pathlib import Path
 
 import paho.mqtt.client as mqtt
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
 
 IOT_DIR = Path("/data/config/aws-iot")
 PKI_DIR = Path("/data/config/pki")
 ECR_DIR = Path("/data/config/ecr")
 CLAIM_DIR = Path("/etc/edge-ai/claim")
-AMAZON_ROOT_CA_URL = "https://www.amazontrust.com/repository/AmazonRootCA1.pem"
+NET_DIR = Path("/sys/class/net")
+ARPHRD_ETHER = "1"
+AMAZON_ROOT_CA_SHA256 = "8ecde6884f3d87b1125ba31ac3fcb13d7016de7f57cc904fe1cb97c6ae98196e"
+BUNDLED_ROOT_CA = Path("/etc/edge-ai/AmazonRootCA1.pem")
+JSON_ENCODE = json.JSONEncoder(separators=(",", ":")).encode
 
 
 def log(msg):
@@ -30,6 +37,25 @@ def err(msg):
     print(f"[edge-provision] {time.strftime('%Y-%m-%d %H:%M:%S')} ERROR: {msg}", file=sys.stderr, flush=True)
 
 
+def write_atomic(path, data, mode=0o600):
+    """Write file atomically."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    try:
+        os.fchmod(fd, mode)
+        os.write(fd, data)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    os.replace(tmp_path, path)
+
+    dir_fd = os.open(path.parent, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
 def get_device_serial():
     """Get Jetson serial number from device tree."""
     serial_path = Path("/sys/firmware/devicetree/base/serial-number")
@@ -41,58 +67,59 @@ def get_device_serial():
 def get_mac_address():
     """Get MAC address of first physical ethernet interface."""
     try:
-        result = subprocess.run(
-            ["ip", "-o", "link", "show"],
-            capture_output=True, text=True, check=True
-        )
-        for line in result.stdout.splitlines():
-            if "ether" in line and not any(x in line for x in ["docker", "lo", "veth"]):
-                parts = line.split()
-                iface = parts[1].rstrip(":")
-                mac_result = subprocess.run(
-                    ["ip", "link", "show", iface],
-                    capture_output=True, text=True, check=True
-                )
-                for mac_line in mac_result.stdout.splitlines():
-                    if "ether" in mac_line:
-                        return mac_line.split()[1].replace(":", "")
-    except Exception:
+        ifaces = [
+            iface for iface in NET_DIR.iterdir()
+            if (iface / "device").exists() and (iface / "type").read_text().strip() == ARPHRD_ETHER
+        ]
+        if ifaces:
+            first = min(ifaces, key=lambda iface: int((iface / "ifindex").read_text()))
+            return (first / "address").read_text().strip().replace(":", "")
+    except OSError:
         pass
     return "unknown"
 
 
-def download_root_ca():
-    """Download Amazon Root CA if not present."""
+def install_root_ca():
+    """Install Amazon Root CA if not present."""
     ca_path = IOT_DIR / "AmazonRootCA1.pem"
-    if not ca_path.exists():
-        log("Downloading Amazon Root CA...")
-        subprocess.run(
-            ["curl", "-sf", "-o", str(ca_path), AMAZON_ROOT_CA_URL],
-            check=True
-        )
+    if ca_path.exists():
+        return ca_path
+
+    ca_pem = BUNDLED_ROOT_CA.read_bytes()
+    ca_cert = x509.load_pem_x509_certificate(ca_pem)
+    if ca_cert.fingerprint(hashes.SHA256()).hex() != AMAZON_ROOT_CA_SHA256:
+        raise RuntimeError("Amazon Root CA fingerprint mismatch")
+    write_atomic(ca_path, ca_pem, mode=0o644)
     return ca_path
 
 
 def generate_key_and_csr(thing_name):
     """Generate device private key and CSR."""
     key_path = IOT_DIR / "private.key"
-    csr_path = IOT_DIR / "device.csr"
 
     log("Generating device key pair...")
-    subprocess.run([
-        "openssl", "ecparam", "-name", "prime256v1",
-        "-genkey", "-noout", "-out", str(key_path)
-    ], check=True)
-    key_path.chmod(0o600)
+    key = ec.generate_private_key(ec.SECP256R1())
+    key_pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    )
+    write_atomic(key_path, key_pem)
+
+    csr = x509.CertificateSigningRequestBuilder().subject_name(
+        x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, thing_name)])
+    ).sign(key, hashes.SHA256())
 
-    subprocess.run([
-        "openssl", "req", "-new",
-        "-key", str(key_path),
-        "-out", str(csr_path),
-        "-subj", f"/CN={thing_name}"
-    ], check=True)
+    return key_path, csr.public_bytes(serialization.Encoding.PEM).decode()
 
-    return key_path, csr_path
+
+def create_ssl_context(ca_path, cert_path, key_path):
+    """Create TLS context for AWS IoT."""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_verify_locations(cafile=ca_path)
+    context.load_cert_chain(certfile=cert_path, keyfile=key_path)
+    return context
 
 
 class FleetProvisioner:
@@ -102,37 +129,78 @@ class FleetProvisioner:
         self.endpoint = endpoint
         self.template_name = template_name
         self.thing_name = thing_name
-        self.response = None
-        self.error = None
-        self.response_event = threading.Event()
-        self.subscribed_count = 0
-        self.expected_subs = 0
+        self.client = None
+        self.connection_error = None
+        self.connected = threading.Event()
+        self.pending = {}
+        self.pending_subs = set()
+        self.subscribed = threading.Event()
+
+    def __enter__(self):
+        self.client = self._create_client()
+        self.client.connect(self.endpoint, 8883, keepalive=60)
+        try:
+            if not self._run_until(self.connected, timeout=10):
+                raise TimeoutError("No CONNACK received")
+            if self.connection_error:
+                raise RuntimeError(self.connection_error)
+        except Exception:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.client.disconnect()
+
+    def _run_until(self, event, timeout):
+        """Run the network loop until event is set."""
+        deadline = time.monotonic() + timeout
+        while not event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            rc = self.client.loop(timeout=min(remaining, 1.0))
+            if rc != mqtt.MQTT_ERR_SUCCESS and not event.is_set():
+                raise RuntimeError(f"MQTT connection lost: {mqtt.error_string(rc)}")
+        return True
+
+    def _fail_pending(self, error):
+        """Fail all pending requests."""
+        for request in self.pending.values():
+            if not request["event"].is_set():
+                request["error"] = error
+                request["event"].set()
 
     def _on_connect(self, client, userdata, flags, reason_code, properties):
         if reason_code != 0:
             err(f"Connection failed: {reason_code}")
-            self.error = f"Connection failed: {reason_code}"
-            self.response_event.set()
+            self.connection_error = f"Connection failed: {reason_code}"
+            self._fail_pending(self.connection_error)
+        self.connected.set()
 
     def _on_subscribe(self, client, userdata, mid, reason_codes, properties):
-        self.subscribed_count += 1
+        self.pending_subs.discard(mid)
+        if not self.pending_subs:
+            self.subscribed.set()
 
     def _on_message(self, client, userdata, msg):
+        topic, _, result = msg.topic.rpartition("/")
+        request = self.pending.get(topic)
+        if request is None:
+            return
         try:
-            payload = json.loads(msg.payload.decode())
-            if "/accepted" in msg.topic:
-                self.response = payload
-            elif "/rejected" in msg.topic:
-                self.error = payload.get("errorMessage", str(payload))
-            self.response_event.set()
+            payload = json.loads(msg.payload)
+            if result == "accepted":
+                request["response"] = payload
+            elif result == "rejected":
+                request["error"] = payload.get("errorMessage", str(payload))
         except Exception as e:
-            self.error = str(e)
-            self.response_event.set()
+            request["error"] = str(e)
+        request["event"].set()
 
     def _on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
-        if reason_code != 0 and not self.response_event.is_set():
-            self.error = f"Disconnected: {reason_code}"
-            self.response_event.set()
+        if reason_code != 0:
+            self._fail_pending(f"Disconnected: {reason_code}")
 
     def _create_client(self):
         """Create MQTT client with explicit client ID (required for Fleet Provisioning)."""
@@ -146,68 +214,51 @@ class FleetProvisioner:
         client.on_message = self._on_message
         client.on_disconnect = self._on_disconnect
 
-        client.tls_set(
-            ca_certs=str(IOT_DIR / "AmazonRootCA1.pem"),
-            certfile=str(CLAIM_DIR / "claim.crt"),
-            keyfile=str(CLAIM_DIR / "claim.key"),
-            tls_version=ssl.PROTOCOL_TLSv1_2
-        )
+        client.tls_set_context(create_ssl_context(
+            IOT_DIR / "AmazonRootCA1.pem", CLAIM_DIR / "claim.crt", CLAIM_DIR / "claim.key"
+        ))
         return client
 
-    def _mqtt_request(self, sub_topics, pub_topic, payload):
+    def _mqtt_request(self, topic, payload):
         """Send MQTT request and wait for response."""
-        client = self._create_client()
-        self.response = None
-        self.error = None
-        self.response_event.clear()
-        self.subscribed_count = 0
-        self.expected_subs = len(sub_topics)
+        if self.connection_error:
+            raise RuntimeError(self.connection_error)
 
-        client.connect(self.endpoint, 8883, keepalive=60)
-        client.loop_start()
+        request = {"event": threading.Event(), "response": None, "error": None}
+        self.pending[topic] = request
+        self.subscribed.clear()
 
         try:
-            time.sleep(0.5)
-            for topic in sub_topics:
-                client.subscribe(topic, qos=1)
+            _, mid = self.client.subscribe([(f"{topic}/accepted", 1), (f"{topic}/rejected", 1)])
+            self.pending_subs.add(mid)
 
-            # Wait for subscriptions
-            for _ in range(20):
-                if self.subscribed_count >= self.expected_subs:
-                    break
-                time.sleep(0.1)
+            if not self._run_until(self.subscribed, timeout=10):
+                raise TimeoutError("No SUBACK received")
 
-            client.publish(pub_topic, json.dumps(payload), qos=1)
+            self.client.publish(topic, JSON_ENCODE(payload).encode(), qos=1)
 
-            if not self.response_event.wait(timeout=30):
+            if not self._run_until(request["event"], timeout=30):
                 raise TimeoutError("No response received")
-            if self.error:
-                raise RuntimeError(self.error)
-            return self.response
+            if request["error"]:
+                raise RuntimeError(request["error"])
+            return request["response"]
         finally:
-            client.loop_stop()
-            client.disconnect()
+            del self.pending[topic]
 
     def create_certificate_from_csr(self, csr_pem):
         """Request certificate from Fleet Provisioning."""
         log("Requesting certificate from AWS IoT...")
         return self._mqtt_request(
-            sub_topics=[
-                "$aws/certificates/create-from-csr/json/accepted",
-                "$aws/certificates/create-from-csr/json/rejected"
-            ],
-            pub_topic="$aws/certificates/create-from-csr/json",
-            payload={"certificateSigningRequest": csr_pem}
+            "$aws/certificates/create-from-csr/json",
+            {"certificateSigningRequest": csr_pem}
         )
 
     def register_thing(self, ownership_token, serial, mac):
         """Register thing using provisioning template."""
         log(f"Registering thing: {self.thing_name}")
-        topic_base = f"$aws/provisioning-templates/{self.template_name}/provision/json"
         return self._mqtt_request(
-            sub_topics=[f"{topic_base}/accepted", f"{topic_base}/rejected"],
-            pub_topic=topic_base,
-            payload={
+            f"$aws/provisioning-templates/{self.template_name}/provision/json",
+            {
                 "certificateOwnershipToken": ownership_token,
                 "parameters": {
                     "SerialNumber": serial,
@@ -247,31 +298,28 @@ def provision_device():
     # Ensure directories exist
     IOT_DIR.mkdir(parents=True, exist_ok=True)
 
-    # Download Root CA
-    download_root_ca()
+    # Install Root CA
+    install_root_ca()
 
     # Generate key and CSR
-    key_path, csr_path = generate_key_and_csr(thing_name)
-    csr_pem = csr_path.read_text()
+    key_path, csr_pem = generate_key_and_csr(thing_name)
 
     # Fleet Provisioning
-    provisioner = FleetProvisioner(endpoint, template_name, thing_name)
-
-    # Step 1: Create certificate from CSR
-    cert_response = provisioner.create_certificate_from_csr(csr_pem)
-    cert_pem = cert_response["certificatePem"]
-    ownership_token = cert_response["certificateOwnershipToken"]
-    log(f"Received certificate: {cert_response['certificateId'][:16]}...")
-
-    # Save certificate
+    mac = get_mac_address()
     cert_path = IOT_DIR / "device.crt"
-    cert_path.write_text(cert_pem)
-    cert_path.chmod(0o600)
+    with FleetProvisioner(endpoint, template_name, thing_name) as provisioner:
+        # Step 1: Create certificate from CSR
+        cert_response = provisioner.create_certificate_from_csr(csr_pem)
+        cert_pem = cert_response["certificatePem"]
+        ownership_token = cert_response["certificateOwnershipToken"]
+        log(f"Received certificate: {cert_response['certificateId'][:16]}...")
 
-    # Step 2: Register thing
-    mac = get_mac_address()
-    thing_response = provisioner.register_thing(ownership_token, serial, mac)
-    log(f"Registered thing: {thing_response['thingName']}")
+        # Save certificate
+        write_atomic(cert_path, cert_pem.encode())
+
+        # Step 2: Register thing
+        thing_response = provisioner.register_thing(ownership_token, serial, mac)
+        log(f"Registered thing: {thing_response['thingName']}")
 
     # Write final config
     config = {
@@ -282,9 +330,7 @@ def provision_device():
         "ca_path": str(IOT_DIR / "AmazonRootCA1.pem")
     }
 
-    with open(config_path, "w") as f:
-        json.dump(config, f, indent=2)
-    config_path.chmod(0o600)
+    write_atomic(config_path, JSON_ENCODE(config).encode())
 
     log("Provisioning complete")
     return True
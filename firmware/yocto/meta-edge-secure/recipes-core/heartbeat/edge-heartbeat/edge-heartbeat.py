@@ -9,10 +9,13 @@ Publishes device state to shadow every interval:
 - Timestamp
 """
 
+import http.client
 import json
+import math
 import os
+import signal
+import socket
 import ssl
-import subprocess
 import sys
 import threading
 import time
@@ -22,6 +25,11 @@ import paho.mqtt.client as mqtt
 
 IOT_CONFIG = Path("/data/config/aws-iot/config.json")
 HEARTBEAT_INTERVAL = 300  # 5 minutes
+IP_CACHE_SECONDS = 600
+DOCKER_SOCKET = "/var/run/docker.sock"
+JSON_ENCODE = json.JSONEncoder(separators=(",", ":")).encode
+
+_ip_cache = (float("-inf"), None)
 
 
 def log(msg):
@@ -40,15 +48,15 @@ def get_uptime():
 def get_memory():
     """Get memory usage percentage."""
     try:
-        with open("/proc/meminfo") as f:
-            lines = f.readlines()
         meminfo = {}
-        for line in lines:
-            parts = line.split()
-            meminfo[parts[0].rstrip(":")] = int(parts[1])
-        total = meminfo.get("MemTotal", 1)
-        available = meminfo.get("MemAvailable", 0)
-        return round((1 - available / total) * 100, 1)
+        with open("/proc/meminfo") as f:
+            for line in f:
+                key, value = line.split(":", 1)
+                if key in ("MemTotal", "MemAvailable"):
+                    meminfo[key] = int(value.split()[0])
+                    if len(meminfo) == 2:
+                        break
+        return round((1 - meminfo["MemAvailable"] / meminfo["MemTotal"]) * 100, 1)
     except Exception:
         return 0
 
@@ -56,47 +64,61 @@ def get_memory():
 def get_disk_usage():
     """Get /data partition usage percentage."""
     try:
-        result = subprocess.run(
-            ["df", "/data"],
-            capture_output=True, text=True, check=True
-        )
-        lines = result.stdout.strip().split("\n")
-        if len(lines) >= 2:
-            parts = lines[1].split()
-            return int(parts[4].rstrip("%"))
-    except Exception:
-        pass
-    return 0
+        st = os.statvfs("/data")
+        used = st.f_blocks - st.f_bfree
+        return math.ceil(used * 100 / (used + st.f_bavail))
+    except (OSError, ZeroDivisionError):
+        return 0
+
+
+class DockerSocketConnection(http.client.HTTPConnection):
+    """HTTP connection over the Docker socket."""
+
+    def __init__(self, socket_path=DOCKER_SOCKET):
+        super().__init__("localhost", timeout=5)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
 
 
 def get_container_count():
     """Get number of running containers."""
+    conn = DockerSocketConnection()
     try:
-        result = subprocess.run(
-            ["docker", "ps", "-q"],
-            capture_output=True, text=True, check=True
-        )
-        return len(result.stdout.strip().split("\n")) if result.stdout.strip() else 0
-    except Exception:
+        conn.request("GET", "/containers/json")
+        response = conn.getresponse()
+        if response.status != 200:
+            return 0
+        return len(json.loads(response.read()))
+    except (OSError, http.client.HTTPException, ValueError):
         return 0
+    finally:
+        conn.close()
 
 
 def get_ip_address():
     """Get primary IP address."""
+    global _ip_cache
+    checked, ip = _ip_cache
+    if time.monotonic() - checked < IP_CACHE_SECONDS:
+        return ip
     try:
-        result = subprocess.run(
-            ["ip", "-4", "-o", "addr", "show", "scope", "global"],
-            capture_output=True, text=True, check=True
-        )
-        for line in result.stdout.splitlines():
-            if "docker" not in line and "veth" not in line:
-                parts = line.split()
-                for i, part in enumerate(parts):
-                    if part == "inet":
-                        return parts[i + 1].split("/")[0]
-    except Exception:
-        pass
-    return "unknown"
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.connect(("1.1.1.1", 80))
+            ip = sock.getsockname()[0]
+    except OSError:
+        return "unknown"
+    _ip_cache = (time.monotonic(), ip)
+    return ip
+
+
+def invalidate_ip_address():
+    """Clear cached IP address."""
+    global _ip_cache
+    _ip_cache = (float("-inf"), None)
 
 
 def collect_state():
@@ -111,17 +133,38 @@ def collect_state():
     }
 
 
+def create_ssl_context(ca_path, cert_path, key_path):
+    """Create TLS context for AWS IoT."""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_verify_locations(cafile=ca_path)
+    context.load_cert_chain(certfile=cert_path, keyfile=key_path)
+    return context
+
+
 class ShadowUpdater:
     """Updates AWS IoT Device Shadow."""
 
     def __init__(self, config):
         self.endpoint = config["endpoint"]
         self.thing_name = config["thing_name"]
-        self.cert_path = config["cert_path"]
-        self.key_path = config["key_path"]
-        self.ca_path = config["ca_path"]
+        self.topic = f"$aws/things/{self.thing_name}/shadow/update"
         self.connected = threading.Event()
-        self.published = threading.Event()
+
+        self.client = mqtt.Client(
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+            client_id=self.thing_name
+        )
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+
+        self.client.tls_set_context(create_ssl_context(
+            config["ca_path"], config["cert_path"], config["key_path"]
+        ))
+        self.client.reconnect_delay_set(min_delay=1, max_delay=60)
+
+        self.client.connect_async(self.endpoint, 8883, keepalive=60)
+        self.client.loop_start()
 
     def _on_connect(self, client, userdata, flags, reason_code, properties):
         if reason_code == 0:
@@ -129,51 +172,23 @@ class ShadowUpdater:
         else:
             log(f"Connection failed: {reason_code}")
 
-    def _on_publish(self, client, userdata, mid, reason_codes, properties):
-        self.published.set()
+    def _on_disconnect(self, client, userdata, disconnect_flags, reason_code, properties):
+        self.connected.clear()
+        invalidate_ip_address()
+        if reason_code != 0:
+            log(f"Disconnected: {reason_code}, reconnecting")
 
     def update_shadow(self, state):
         """Publish state to device shadow."""
-        client = mqtt.Client(
-            callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
-            client_id=self.thing_name
-        )
-        client.on_connect = self._on_connect
-        client.on_publish = self._on_publish
-
-        client.tls_set(
-            ca_certs=self.ca_path,
-            certfile=self.cert_path,
-            keyfile=self.key_path,
-            tls_version=ssl.PROTOCOL_TLSv1_2
-        )
+        payload = JSON_ENCODE({"state": {"reported": state}}).encode()
+        info = self.client.publish(self.topic, payload, qos=0)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            raise RuntimeError(f"Publish failed: {mqtt.error_string(info.rc)}")
+        return info
 
-        self.connected.clear()
-        self.published.clear()
-
-        client.connect(self.endpoint, 8883, keepalive=60)
-        client.loop_start()
-
-        try:
-            if not self.connected.wait(timeout=10):
-                raise TimeoutError("Connection timeout")
-
-            shadow_payload = {
-                "state": {
-                    "reported": state
-                }
-            }
-
-            topic = f"$aws/things/{self.thing_name}/shadow/update"
-            result = client.publish(topic, json.dumps(shadow_payload), qos=1)
-
-            if not self.published.wait(timeout=10):
-                raise TimeoutError("Publish timeout")
-
-            return True
-        finally:
-            client.loop_stop()
-            client.disconnect()
+    def close(self):
+        self.client.disconnect()
+        self.client.loop_stop()
 
 
 def main():
@@ -189,17 +204,32 @@ def main():
     # Run once if called without arguments, loop if called with --daemon
     daemon_mode = "--daemon" in sys.argv
 
-    while True:
-        try:
-            state = collect_state()
-            updater.update_shadow(state)
-            log(f"Shadow updated: uptime={state['uptime_seconds']}s mem={state['memory_percent']}% containers={state['containers_running']}")
-        except Exception as e:
-            log(f"Failed to update shadow: {e}")
-
-        if not daemon_mode:
-            break
-        time.sleep(HEARTBEAT_INTERVAL)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    next_wake = time.monotonic()
+
+    try:
+        while True:
+            try:
+                state = collect_state()
+                if not updater.connected.wait(timeout=10):
+                    raise TimeoutError("Connection timeout")
+                info = updater.update_shadow(state)
+                if not daemon_mode:
+                    info.wait_for_publish(timeout=10)
+                    if not info.is_published():
+                        raise TimeoutError("Publish timeout")
+                log(f"Shadow update published: uptime={state['uptime_seconds']}s mem={state['memory_percent']}% containers={state['containers_running']}")
+            except Exception as e:
+                log(f"Failed to update shadow: {e}")
+
+            if not daemon_mode:
+                break
+            next_wake = max(next_wake + HEARTBEAT_INTERVAL, time.monotonic())
+            if stop.wait(timeout=next_wake - time.monotonic()):
+                break
+    finally:
+        updater.close()
 
 
 if __name__ == "__main__":